@@ -3,108 +3,465 @@ Database layer using SQLite with aiosqlite
 Stores strategies, iterations, and configuration
 """
 
+import asyncio
 import json
+import queue
+import sqlite3
+import threading
 import aiosqlite
-from datetime import datetime
+import zstandard
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
+from pydantic import TypeAdapter
 
 from models import (
     Strategy,
+    StrategySummary,
     Iteration,
-    RefinementConfig,
-    BacktestResult,
-    AnalysisResult
+    RefinementConfig
 )
 
 
+# Connection tuning. WAL lets the API's readers run alongside the refinement
+# loop's writes, and synchronous=NORMAL means a commit costs ~1 fsync (the WAL
+# append) instead of 2 (journal + database file). Checkpoints still fsync.
+PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",    # 64 MiB page cache
+    "PRAGMA mmap_size=268435456",  # 256 MiB memory-mapped I/O
+    "PRAGMA busy_timeout=5000",
+)
+
+# Deleting a strategy cascades to its iterations (needs foreign_keys=ON)
+ITERATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id TEXT PRIMARY KEY,
+        strategy_id TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        backtest_result BLOB NOT NULL,
+        analysis BLOB NOT NULL,
+        code_before BLOB NOT NULL,
+        code_after BLOB NOT NULL,
+        improvement REAL DEFAULT 0,
+        FOREIGN KEY (strategy_id) REFERENCES strategies(id) ON DELETE CASCADE
+    );
+"""
+
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS strategies (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        code TEXT NOT NULL,
+        description TEXT,
+        created_at TEXT NOT NULL,
+        current_version INTEGER DEFAULT 1,
+        qc_project_id TEXT,
+        best_sharpe REAL DEFAULT 0,
+        best_version INTEGER DEFAULT 1
+    );
+    
+    {ITERATIONS_TABLE.format(name="iterations").strip()}
+    
+    CREATE TABLE IF NOT EXISTS config (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        data TEXT NOT NULL
+    );
+    
+    -- One range scan serves "WHERE strategy_id = ? ORDER BY timestamp DESC
+    -- LIMIT ?" and stops after LIMIT rows, with no sort step
+    CREATE INDEX IF NOT EXISTS idx_iter_strat_ts 
+        ON iterations(strategy_id, timestamp DESC);
+    DROP INDEX IF EXISTS idx_iterations_strategy;
+    DROP INDEX IF EXISTS idx_iterations_timestamp;
+"""
+
+# Databases created before ON DELETE CASCADE get their iterations table
+# rebuilt once; orphaned rows are dropped. Runs with foreign_keys off.
+MIGRATE_ITERATIONS_FK = f"""
+    BEGIN;
+    {ITERATIONS_TABLE.format(name="iterations_new").strip()}
+    INSERT INTO iterations_new 
+        SELECT id, strategy_id, version, timestamp, backtest_result, 
+               analysis, code_before, code_after, improvement
+        FROM iterations
+        WHERE strategy_id IN (SELECT id FROM strategies);
+    DROP TABLE iterations;
+    ALTER TABLE iterations_new RENAME TO iterations;
+    CREATE INDEX IF NOT EXISTS idx_iter_strat_ts 
+        ON iterations(strategy_id, timestamp DESC);
+    COMMIT;
+"""
+
+# SQLite 3.45+ stores JSON as pre-parsed JSONB blobs; older builds keep text.
+# json() reads either form back as text, so mixed rows are fine.
+JSONB = sqlite3.sqlite_version_info >= (3, 45, 0)
+JSON_IN = "jsonb(?)" if JSONB else "?"
+JSON_OUT = "json({})" if JSONB else "{}"
+
+# Column lists for reads; list views leave out the large code columns
+STRATEGY_SUMMARY_COLUMNS = """
+    id, name, description, created_at, current_version,
+    qc_project_id, best_sharpe, best_version
+"""
+ITERATION_COLUMNS = f"""
+    id, strategy_id, version, timestamp, improvement,
+    {JSON_OUT.format("backtest_result")}, {JSON_OUT.format("analysis")}
+"""
+
+# Hot statements, built once so each call reuses the exact same SQL text
+# and hits sqlite3's per-connection prepared statement cache
+# An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row,
+# which would cascade and wipe the strategy's iterations
+INSERT_STRATEGY_SQL = """
+    INSERT INTO strategies 
+    (id, name, code, description, created_at, current_version, 
+     qc_project_id, best_sharpe, best_version)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        name = excluded.name,
+        code = excluded.code,
+        description = excluded.description,
+        created_at = excluded.created_at,
+        current_version = excluded.current_version,
+        qc_project_id = excluded.qc_project_id,
+        best_sharpe = excluded.best_sharpe,
+        best_version = excluded.best_version
+"""
+SELECT_STRATEGY_SQL = f"""
+    SELECT {STRATEGY_SUMMARY_COLUMNS}, code 
+    FROM strategies WHERE id = ?
+"""
+# Each strategy's latest Sharpe comes from the same query (one index probe
+# per strategy) rather than N follow-up reads
+SELECT_STRATEGY_SUMMARIES_SQL = f"""
+    SELECT {STRATEGY_SUMMARY_COLUMNS}, (
+        SELECT json_extract(i.backtest_result, '$.sharpe_ratio')
+        FROM iterations i
+        WHERE i.strategy_id = strategies.id
+        ORDER BY i.timestamp DESC
+        LIMIT 1
+    ) AS latest_sharpe
+    FROM strategies ORDER BY created_at DESC
+"""
+INSERT_ITERATION_SQL = f"""
+    INSERT INTO iterations 
+    (id, strategy_id, version, timestamp, backtest_result, 
+     analysis, code_before, code_after, improvement)
+    VALUES (?, ?, ?, ?, {JSON_IN}, {JSON_IN}, ?, ?, ?)
+"""
+SELECT_ITERATIONS_SQL = {
+    include_code: f"""
+        SELECT {ITERATION_COLUMNS}{", code_before, code_after" if include_code else ""}
+        FROM iterations 
+        WHERE strategy_id = ? 
+        ORDER BY timestamp DESC 
+        LIMIT ?
+    """
+    for include_code in (True, False)
+}
+SELECT_ITERATIONS_JSON_SQL = {
+    # One Iteration.model_dump()-shaped JSON object per row. Compressed code
+    # can't go through json_object, so with include_code it comes back as
+    # extra columns and is spliced in by _iteration_json
+    include_code: f"""
+        SELECT json_object(
+            'id', id,
+            'strategy_id', strategy_id,
+            'version', version,
+            'timestamp', timestamp,
+            'backtest_result', json(backtest_result),
+            'analysis', json(analysis),
+            {code_fields}
+            'improvement', improvement
+        ) AS obj{code_columns}
+        FROM iterations 
+        WHERE strategy_id = ? 
+        ORDER BY timestamp DESC 
+        LIMIT ?
+    """
+    for include_code, code_fields, code_columns in (
+        (True, "", ", code_before, code_after"),
+        (False, "'code_before', '', 'code_after', '',", "")
+    )
+}
+
+# The code-less JSON rows aggregated into one array. json() on the
+# aggregate input keeps each object as JSON rather than a quoted string
+# once it leaves the subquery
+SELECT_ITERATIONS_ARRAY_SQL = (
+    f"SELECT json_group_array(json(obj)) FROM ({SELECT_ITERATIONS_JSON_SQL[False]})"
+)
+
+# Per-connection prepared statement cache (sqlite3 defaults to 128)
+CACHED_STATEMENTS = 256
+
+# Batch validators, built once; one call validates a whole result set.
+# Timestamps are handed over as stored ISO-8601 text and parsed by Pydantic.
+SUMMARIES_ADAPTER = TypeAdapter(list[StrategySummary])
+ITERATIONS_ADAPTER = TypeAdapter(list[Iteration])
+
+# Rows fetched per chunk when streaming JSON responses
+STREAM_CHUNK_ROWS = 16
+
+# Max queued writes the writer thread folds into one transaction
+WRITE_BATCH_SIZE = 64
+
+# Read-only connections serving API reads from WAL snapshots
+READER_POOL_SIZE = 4
+
+
+# Strategy source is stored zstd-compressed; rows written before
+# compression hold plain text and are returned as-is
+_compressor = zstandard.ZstdCompressor(level=3)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def compress_code(code: str) -> bytes:
+    return _compressor.compress(code.encode())
+
+
+def decompress_code(value: bytes | str) -> str:
+    if isinstance(value, str):
+        return value
+    return _decompressor.decompress(value).decode()
+
+
+def _iteration_json(row: tuple) -> str:
+    """JSON object for a SELECT_ITERATIONS_JSON_SQL row"""
+    if len(row) == 1:
+        return row[0]
+    obj, code_before, code_after = row
+    return "".join([
+        obj[:-1],
+        ',"code_before":', json.dumps(decompress_code(code_before)),
+        ',"code_after":', json.dumps(decompress_code(code_after)),
+        "}"
+    ])
+
+
+def _strategy_row(strategy: Strategy) -> tuple:
+    """Parameters for INSERT_STRATEGY_SQL"""
+    return (
+        strategy.id,
+        strategy.name,
+        strategy.code,
+        strategy.description,
+        strategy.created_at.isoformat(),
+        strategy.current_version,
+        strategy.qc_project_id,
+        strategy.best_sharpe,
+        strategy.best_version
+    )
+
+
+def _iteration_row(iteration: Iteration) -> tuple:
+    """Parameters for INSERT_ITERATION_SQL"""
+    return (
+        iteration.id,
+        iteration.strategy_id,
+        iteration.version,
+        iteration.timestamp.isoformat(),
+        iteration.backtest_result.model_dump_json(),
+        iteration.analysis.model_dump_json(),
+        compress_code(iteration.code_before),
+        compress_code(iteration.code_after),
+        iteration.improvement
+    )
+
+
+def _resolve(future: asyncio.Future, error: Optional[BaseException]):
+    """Complete a write future (runs on the event loop thread)"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
+
+
 class Database:
     """
     Async SQLite database for persisting refinement data
+    
+    Writes are handed to a dedicated thread that owns a plain sqlite3
+    connection and commits whatever has queued up in one transaction.
+    Reads check out one of a small pool of read-only aiosqlite
+    connections, so concurrent requests don't queue behind each other.
     """
     
     def __init__(self, db_path: str = "refinery.db"):
         self.db_path = Path(db_path)
-        self._connection: Optional[aiosqlite.Connection] = None
+        # A private :memory: database is invisible to other connections, so
+        # the writer and readers share a named in-memory database instead
+        self._memory_uri: Optional[str] = None
+        if str(db_path) == ":memory:":
+            self._memory_uri = f"file:refinery-{id(self)}?mode=memory&cache=shared"
+        self._readers: list[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
     
     async def initialize(self):
-        """Create tables if they don't exist"""
-        self._connection = await aiosqlite.connect(self.db_path)
+        """Start the writer thread, create tables, open the reader pool"""
+        self._loop = asyncio.get_running_loop()
+        ready = self._loop.create_future()
+        self._writer = threading.Thread(
+            target=self._writer_loop,
+            args=(ready,),
+            name="db-writer",
+            daemon=True
+        )
+        self._writer.start()
+        await ready
         
-        await self._connection.executescript("""
-            CREATE TABLE IF NOT EXISTS strategies (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                code TEXT NOT NULL,
-                description TEXT,
-                created_at TEXT NOT NULL,
-                current_version INTEGER DEFAULT 1,
-                qc_project_id TEXT,
-                best_sharpe REAL DEFAULT 0,
-                best_version INTEGER DEFAULT 1
-            );
-            
-            CREATE TABLE IF NOT EXISTS iterations (
-                id TEXT PRIMARY KEY,
-                strategy_id TEXT NOT NULL,
-                version INTEGER NOT NULL,
-                timestamp TEXT NOT NULL,
-                backtest_result TEXT NOT NULL,
-                analysis TEXT NOT NULL,
-                code_before TEXT NOT NULL,
-                code_after TEXT NOT NULL,
-                improvement REAL DEFAULT 0,
-                FOREIGN KEY (strategy_id) REFERENCES strategies(id)
-            );
+        if self._memory_uri:
+            # mode=ro can't be combined with mode=memory. Shared-cache
+            # readers take table locks that fail the writer with "database
+            # table is locked"; read_uncommitted skips them
+            uri = self._memory_uri
+            pragmas = PRAGMAS + (
+                "PRAGMA query_only=ON",
+                "PRAGMA read_uncommitted=ON",
+            )
+        else:
+            uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+            pragmas = PRAGMAS
+        self._idle_readers = asyncio.Queue()
+        for _ in range(READER_POOL_SIZE):
+            reader = await aiosqlite.connect(
+                uri,
+                uri=True,
+                cached_statements=CACHED_STATEMENTS
+            )
+            for pragma in pragmas:
+                await reader.execute(pragma)
+            self._readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+    
+    async def close(self):
+        """Flush pending writes and close database connections"""
+        if self._writer:
+            self._write_queue.put(None)
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
+        self._idle_readers = None
+    
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Check out a read-only connection for the duration of the block"""
+        reader = await self._idle_readers.get()
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+    
+    # ============ Writer Thread ============
+    
+    async def _write(self, *ops: tuple[str, list[tuple]]):
+        """
+        Queue (sql, rows) statements for the writer thread
+        All ops of one call commit atomically
+        """
+        future = self._loop.create_future()
+        self._write_queue.put((ops, future))
+        await future
+    
+    def _connect_writer(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._memory_uri or self.db_path,
+            uri=self._memory_uri is not None,
+            isolation_level=None,
+            cached_statements=CACHED_STATEMENTS
+        )
+        # WAL needs a real file; an in-memory database ignores it
+        if not self._memory_uri:
+            conn.execute("PRAGMA journal_mode=WAL")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.executescript(SCHEMA)
+        
+        fks = conn.execute("PRAGMA foreign_key_list(iterations)").fetchall()
+        if any(fk[6] != "CASCADE" for fk in fks):
+            conn.executescript(MIGRATE_ITERATIONS_FK)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+    
+    def _writer_loop(self, ready: asyncio.Future):
+        """Drain the write queue, committing up to WRITE_BATCH_SIZE at a time"""
+        try:
+            conn = self._connect_writer()
+        except Exception as e:
+            self._loop.call_soon_threadsafe(_resolve, ready, e)
+            return
+        self._loop.call_soon_threadsafe(_resolve, ready, None)
+        
+        stopping = False
+        while not stopping:
+            item = self._write_queue.get()
+            if item is None:
+                break
             
-            CREATE TABLE IF NOT EXISTS config (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                data TEXT NOT NULL
-            );
+            batch = [item]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    item = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
             
-            CREATE INDEX IF NOT EXISTS idx_iterations_strategy 
-                ON iterations(strategy_id);
-            CREATE INDEX IF NOT EXISTS idx_iterations_timestamp 
-                ON iterations(timestamp DESC);
-        """)
+            self._commit_batch(conn, batch)
         
-        await self._connection.commit()
+        conn.close()
     
-    async def close(self):
-        """Close database connection"""
-        if self._connection:
-            await self._connection.close()
-            self._connection = None
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list):
+        try:
+            conn.execute("BEGIN")
+            for ops, _ in batch:
+                for sql, rows in ops:
+                    conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+            error = None
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if len(batch) > 1:
+                # Retry one by one so only the failing write reports an error
+                for item in batch:
+                    self._commit_batch(conn, [item])
+                return
+            error = e
+        
+        for _, future in batch:
+            self._loop.call_soon_threadsafe(_resolve, future, error)
     
     # ============ Strategy Operations ============
     
     async def save_strategy(self, strategy: Strategy):
         """Insert or update a strategy"""
-        await self._connection.execute("""
-            INSERT OR REPLACE INTO strategies 
-            (id, name, code, description, created_at, current_version, 
-             qc_project_id, best_sharpe, best_version)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            strategy.id,
-            strategy.name,
-            strategy.code,
-            strategy.description,
-            strategy.created_at.isoformat(),
-            strategy.current_version,
-            strategy.qc_project_id,
-            strategy.best_sharpe,
-            strategy.best_version
-        ))
-        await self._connection.commit()
+        await self.save_strategies([strategy])
+    
+    async def save_strategies(self, strategies: list[Strategy]):
+        """Insert or update several strategies in one transaction"""
+        rows = [_strategy_row(strategy) for strategy in strategies]
+        if not rows:
+            return
+        await self._write((INSERT_STRATEGY_SQL, rows))
     
     async def get_strategy(self, strategy_id: str) -> Optional[Strategy]:
         """Get a strategy by ID"""
-        cursor = await self._connection.execute(
-            "SELECT * FROM strategies WHERE id = ?",
-            (strategy_id,)
-        )
-        row = await cursor.fetchone()
+        async with self._read() as conn:
+            cursor = await conn.execute(SELECT_STRATEGY_SQL, (strategy_id,))
+            row = await cursor.fetchone()
         
         if not row:
             return None
@@ -112,117 +469,187 @@ class Database:
         return Strategy(
             id=row[0],
             name=row[1],
-            code=row[2],
-            description=row[3],
-            created_at=datetime.fromisoformat(row[4]),
-            current_version=row[5],
-            qc_project_id=row[6],
-            best_sharpe=row[7],
-            best_version=row[8]
+            description=row[2],
+            created_at=row[3],
+            current_version=row[4],
+            qc_project_id=row[5],
+            best_sharpe=row[6],
+            best_version=row[7],
+            code=row[8]
         )
     
-    async def get_all_strategies(self) -> list[Strategy]:
-        """Get all strategies"""
-        cursor = await self._connection.execute(
-            "SELECT * FROM strategies ORDER BY created_at DESC"
-        )
-        rows = await cursor.fetchall()
+    async def list_strategies_summary(self) -> list[StrategySummary]:
+        """
+        Get all strategies without their code
+        Each carries its latest iteration's Sharpe
+        """
+        async with self._read() as conn:
+            cursor = await conn.execute(SELECT_STRATEGY_SUMMARIES_SQL)
+            rows = await cursor.fetchall()
         
-        return [
-            Strategy(
-                id=row[0],
-                name=row[1],
-                code=row[2],
-                description=row[3],
-                created_at=datetime.fromisoformat(row[4]),
-                current_version=row[5],
-                qc_project_id=row[6],
-                best_sharpe=row[7],
-                best_version=row[8]
-            )
+        return SUMMARIES_ADAPTER.validate_python([
+            {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2],
+                "created_at": row[3],
+                "current_version": row[4],
+                "qc_project_id": row[5],
+                "best_sharpe": row[6],
+                "best_version": row[7],
+                "latest_sharpe": row[8]
+            }
             for row in rows
-        ]
+        ])
     
     async def delete_strategy(self, strategy_id: str):
-        """Delete a strategy and its iterations"""
-        await self._connection.execute(
-            "DELETE FROM iterations WHERE strategy_id = ?",
-            (strategy_id,)
-        )
-        await self._connection.execute(
-            "DELETE FROM strategies WHERE id = ?",
-            (strategy_id,)
+        """Delete a strategy and (by cascade) its iterations"""
+        await self._write(
+            ("DELETE FROM strategies WHERE id = ?", [(strategy_id,)])
         )
-        await self._connection.commit()
     
     # ============ Iteration Operations ============
     
     async def save_iteration(self, iteration: Iteration):
         """Save an iteration"""
-        await self._connection.execute("""
-            INSERT INTO iterations 
-            (id, strategy_id, version, timestamp, backtest_result, 
-             analysis, code_before, code_after, improvement)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            iteration.id,
-            iteration.strategy_id,
-            iteration.version,
-            iteration.timestamp.isoformat(),
-            iteration.backtest_result.model_dump_json(),
-            iteration.analysis.model_dump_json(),
-            iteration.code_before,
-            iteration.code_after,
-            iteration.improvement
-        ))
-        await self._connection.commit()
+        await self.save_iterations([iteration])
+    
+    async def save_iterations(self, iterations: list[Iteration]):
+        """Save several iterations in one transaction"""
+        rows = [_iteration_row(iteration) for iteration in iterations]
+        if not rows:
+            return
+        await self._write((INSERT_ITERATION_SQL, rows))
+    
+    async def save_iteration_and_bump_strategy(
+        self,
+        iteration: Iteration,
+        strategy: Strategy
+    ):
+        """Save an iteration and the strategy it updated in one transaction"""
+        await self._write(
+            (INSERT_ITERATION_SQL, [_iteration_row(iteration)]),
+            (INSERT_STRATEGY_SQL, [_strategy_row(strategy)])
+        )
     
     async def get_iterations(
         self, 
         strategy_id: str, 
-        limit: int = 50
+        limit: int = 50,
+        include_code: bool = True
     ) -> list[Iteration]:
-        """Get iterations for a strategy"""
-        cursor = await self._connection.execute("""
-            SELECT * FROM iterations 
-            WHERE strategy_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        """, (strategy_id, limit))
+        """
+        Get iterations for a strategy
+        code_before/code_after are left empty unless include_code is set
+        """
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                SELECT_ITERATIONS_SQL[include_code],
+                (strategy_id, limit)
+            )
+            rows = await cursor.fetchall()
         
-        rows = await cursor.fetchall()
+        return ITERATIONS_ADAPTER.validate_python([
+            {
+                "id": row[0],
+                "strategy_id": row[1],
+                "version": row[2],
+                "timestamp": row[3],
+                "improvement": row[4],
+                "backtest_result": json.loads(row[5]),
+                "analysis": json.loads(row[6]),
+                "code_before": decompress_code(row[7]) if include_code else "",
+                "code_after": decompress_code(row[8]) if include_code else ""
+            }
+            for row in rows
+        ])
+    
+    async def get_iterations_raw_json(
+        self,
+        strategy_id: str,
+        limit: int = 50,
+        include_code: bool = False
+    ) -> str:
+        """
+        Get iterations as a JSON array string assembled by SQLite
+        Same shape as Iteration.model_dump(), without a Pydantic round-trip
+        """
+        async with self._read() as conn:
+            if include_code:
+                # Code has to be decompressed here, so join rows in Python
+                cursor = await conn.execute(
+                    SELECT_ITERATIONS_JSON_SQL[True],
+                    (strategy_id, limit)
+                )
+                rows = await cursor.fetchall()
+                return "[" + ",".join(_iteration_json(row) for row in rows) + "]"
+            
+            cursor = await conn.execute(
+                SELECT_ITERATIONS_ARRAY_SQL,
+                (strategy_id, limit)
+            )
+            row = await cursor.fetchone()
         
-        return [
-            Iteration(
-                id=row[0],
-                strategy_id=row[1],
-                version=row[2],
-                timestamp=datetime.fromisoformat(row[3]),
-                backtest_result=BacktestResult(**json.loads(row[4])),
-                analysis=AnalysisResult(**json.loads(row[5])),
-                code_before=row[6],
-                code_after=row[7],
-                improvement=row[8]
+        return row[0]
+    
+    async def stream_iterations_json(
+        self,
+        strategy_id: str,
+        limit: int = 50,
+        include_code: bool = False
+    ) -> AsyncIterator[str]:
+        """
+        Yield the iterations JSON array in chunks as rows come off the cursor
+        Holds a reader for the duration of the stream
+        """
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                SELECT_ITERATIONS_JSON_SQL[include_code],
+                (strategy_id, limit)
             )
-            for row in rows
-        ]
+            yield "["
+            separator = ""
+            while rows := await cursor.fetchmany(STREAM_CHUNK_ROWS):
+                yield separator + ",".join(_iteration_json(row) for row in rows)
+                separator = ","
+            yield "]"
     
     async def get_latest_iteration(
         self, 
         strategy_id: str
     ) -> Optional[Iteration]:
         """Get the most recent iteration"""
-        iterations = await self.get_iterations(strategy_id, limit=1)
-        return iterations[0] if iterations else None
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                SELECT_ITERATIONS_SQL[True],
+                (strategy_id, 1)
+            )
+            row = await cursor.fetchone()
+        
+        if not row:
+            return None
+        
+        return Iteration(
+            id=row[0],
+            strategy_id=row[1],
+            version=row[2],
+            timestamp=row[3],
+            improvement=row[4],
+            backtest_result=json.loads(row[5]),
+            analysis=json.loads(row[6]),
+            code_before=decompress_code(row[7]),
+            code_after=decompress_code(row[8])
+        )
     
     # ============ Config Operations ============
     
     async def get_config(self) -> Optional[RefinementConfig]:
         """Get the refinement configuration"""
-        cursor = await self._connection.execute(
-            "SELECT data FROM config WHERE id = 1"
-        )
-        row = await cursor.fetchone()
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                "SELECT data FROM config WHERE id = 1"
+            )
+            row = await cursor.fetchone()
         
         if not row:
             return None
@@ -231,8 +658,7 @@ class Database:
     
     async def save_config(self, config: RefinementConfig):
         """Save refinement configuration"""
-        await self._connection.execute("""
+        await self._write(("""
             INSERT OR REPLACE INTO config (id, data)
             VALUES (1, ?)
-        """, (config.model_dump_json(),))
-        await self._connection.commit()
+        """, [(config.model_dump_json(),)]))
@@ -4,27 +4,29 @@ FastAPI backend with background refinement loop
 """
 
 import os
-import json
 import asyncio
 import logging
 import sys
 from datetime import datetime
 from typing import Optional
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
-# Configure logging to stdout
+# Configure logging to stdout; LOG_LEVEL=WARNING quiets the per-iteration
+# engine and QuantConnect client messages
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger(__name__)
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import anthropic
 import httpx
+import orjson
 
 from refinement_engine import RefinementEngine
 from models import (
@@ -54,7 +56,11 @@ with open(LOG_FILE, "w") as f:
 # Global state
 db = Database()
 engine: Optional[RefinementEngine] = None
-connected_clients: list[WebSocket] = []
+connected_clients: set[WebSocket] = set()
+_closing_clients: set[asyncio.Task] = set()
+
+# Seconds a client gets to accept a broadcast frame before it is dropped
+BROADCAST_SEND_TIMEOUT = 5.0
 
 
 @asynccontextmanager
@@ -65,11 +71,13 @@ async def lifespan(app: FastAPI):
     # Cleanup
     if engine and engine.is_running:
         await engine.stop()
+    await db.close()
 
 
 app = FastAPI(
     title="Trading Refinery",
     description="Autonomous trading strategy refinement platform",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -102,6 +110,7 @@ class ConfigUpdate(BaseModel):
     improvement_threshold: Optional[float] = None
     focus_metric: Optional[str] = None
     auto_stop_on_plateau: Optional[bool] = None
+    speculative_codegen: Optional[bool] = None
 
 
 # ============ WebSocket for Live Updates ============
@@ -109,7 +118,7 @@ class ConfigUpdate(BaseModel):
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    connected_clients.append(websocket)
+    connected_clients.add(websocket)
     try:
         while True:
             # Keep connection alive, listen for pings
@@ -117,25 +126,44 @@ async def websocket_endpoint(websocket: WebSocket):
             if data == "ping":
                 await websocket.send_text("pong")
     except WebSocketDisconnect:
-        connected_clients.remove(websocket)
+        connected_clients.discard(websocket)
 
 
 async def broadcast_update(event: str, data: dict):
-    """Send update to all connected clients"""
-    message = json.dumps({"event": event, "data": data})
-    for client in connected_clients:
-        try:
-            await client.send_text(message)
-        except:
-            pass
+    """Send update to all connected clients concurrently"""
+    # Encode once and send the same bytes frame to every client
+    payload = orjson.dumps({"event": event, "data": data})
+    clients = list(connected_clients)
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(client.send_bytes(payload), BROADCAST_SEND_TIMEOUT)
+            for client in clients
+        ),
+        return_exceptions=True
+    )
+    # Drop clients whose send failed or stalled, so one stuck connection
+    # can't hold up later updates for everyone, and close them so the
+    # browser notices and reconnects
+    for client, result in zip(clients, results):
+        if isinstance(result, Exception):
+            connected_clients.discard(client)
+            task = asyncio.create_task(_close_quietly(client))
+            _closing_clients.add(task)
+            task.add_done_callback(_closing_clients.discard)
+
+
+async def _close_quietly(client: WebSocket):
+    """Close a dropped client, ignoring errors from an already-dead socket"""
+    with suppress(Exception):
+        await asyncio.wait_for(client.close(code=1011), BROADCAST_SEND_TIMEOUT)
 
 
 # ============ Strategy Endpoints ============
 
 @app.get("/api/strategies")
 async def list_strategies():
-    """Get all strategies"""
-    strategies = await db.get_all_strategies()
+    """Get all strategies (metadata only; fetch one by ID for its code)"""
+    strategies = await db.list_strategies_summary()
     return {"strategies": strategies}
 
 
@@ -156,16 +184,35 @@ async def create_strategy(req: StrategyCreate):
 
 
 @app.get("/api/strategies/{strategy_id}")
-async def get_strategy(strategy_id: str):
-    """Get strategy details with iteration history"""
+async def get_strategy(
+    strategy_id: str,
+    include_code: bool = False,
+    iterations: bool = True
+):
+    """
+    Get strategy details with iteration history
+    iterations=false returns just the strategy, for callers that fetch
+    the history separately
+    """
     strategy = await db.get_strategy(strategy_id)
     if not strategy:
         raise HTTPException(404, "Strategy not found")
-    iterations = await db.get_iterations(strategy_id)
-    return {
-        "strategy": strategy.model_dump(),
-        "iterations": [i.model_dump() for i in iterations]
-    }
+    if not iterations:
+        return Response(
+            content=b'{"strategy":' + strategy.model_dump_json().encode() + b'}',
+            media_type="application/json"
+        )
+    iterations_json = await db.get_iterations_raw_json(
+        strategy_id,
+        include_code=include_code
+    )
+    return Response(
+        content=(
+            b'{"strategy":' + strategy.model_dump_json().encode()
+            + b',"iterations":' + iterations_json.encode() + b'}'
+        ),
+        media_type="application/json"
+    )
 
 
 @app.put("/api/strategies/{strategy_id}/code")
@@ -199,8 +246,7 @@ async def get_loop_status():
 async def start_loop(req: StartLoopRequest):
     """Start the autonomous refinement loop"""
     log(f"start_loop called: {req.strategy_id}")
-    print(f"start_loop called with strategy_id: {req.strategy_id}", flush=True)
-    print(f"Config: {req.config}", flush=True)
+    logger.info("start_loop called with strategy_id: %s", req.strategy_id)
 
     global engine
 
@@ -218,9 +264,8 @@ async def start_loop(req: StartLoopRequest):
     )
     
     # Start loop in background
-    print("About to create refinement task...", flush=True)
     asyncio.create_task(engine.run(strategy))
-    print("Refinement task created", flush=True)
+    logger.info("Refinement task created")
 
     return {"status": "started", "strategy_id": req.strategy_id}
 
@@ -257,10 +302,24 @@ async def resume_loop():
 # ============ Iteration History ============
 
 @app.get("/api/iterations/{strategy_id}")
-async def get_iterations(strategy_id: str, limit: int = 50):
+async def get_iterations(
+    strategy_id: str,
+    limit: int = 50,
+    include_code: bool = False
+):
     """Get iteration history for a strategy"""
-    iterations = await db.get_iterations(strategy_id, limit=limit)
-    return {"iterations": [i.model_dump() for i in iterations]}
+    # Stored JSON is streamed straight to the client as SQLite builds it
+    async def body():
+        yield '{"iterations":'
+        async for chunk in db.stream_iterations_json(
+            strategy_id,
+            limit=limit,
+            include_code=include_code
+        ):
+            yield chunk
+        yield '}'
+    
+    return StreamingResponse(body(), media_type="application/json")
 
 
 @app.get("/api/iterations/{strategy_id}/latest")
@@ -36,8 +36,8 @@ class Iteration(BaseModel):
     timestamp: datetime
     backtest_result: BacktestResult
     analysis: AnalysisResult
-    code_before: str
-    code_after: str
+    code_before: str = ""  # Omitted from list reads unless requested
+    code_after: str = ""
     improvement: float = 0.0
 
 
@@ -56,6 +56,19 @@ class Strategy(BaseModel):
     best_version: int = 1
 
 
+class StrategySummary(BaseModel):
+    """Strategy metadata without the source code, for list views"""
+    id: str
+    name: str
+    description: Optional[str] = None
+    created_at: datetime
+    current_version: int = 1
+    qc_project_id: Optional[str] = None
+    best_sharpe: float = 0.0
+    best_version: int = 1
+    latest_sharpe: Optional[float] = None  # From the most recent iteration
+
+
 class RefinementConfig(BaseModel):
     """Configuration for the refinement loop"""
     max_iterations: Optional[int] = None  # None = unlimited
@@ -68,6 +81,7 @@ class RefinementConfig(BaseModel):
     max_code_changes_per_iteration: int = 3
     preserve_winning_logic: bool = True
     exploration_rate: float = 0.2  # Chance to try riskier changes
+    speculative_codegen: bool = False  # Draft code alongside the analysis
 
 
 class LoopStatus(BaseModel):
@@ -5,11 +5,15 @@ Handles all interactions with QuantConnect's REST API
 
 import os
 import asyncio
+import base64
 import hashlib
+import logging
 import time
 from typing import Optional
 import httpx
 
+logger = logging.getLogger(__name__)
+
 
 class QuantConnectClient:
     """
@@ -32,25 +36,44 @@ class QuantConnectClient:
             )
         
         self._client: Optional[httpx.AsyncClient] = None
+        self._auth_headers: Optional[dict] = None
     
     @property
     def client(self) -> httpx.AsyncClient:
         if self._client is None:
-            self._client = httpx.AsyncClient(timeout=60.0)
+            # Polling hits one host repeatedly: keep connections alive and
+            # multiplex over HTTP/2 so polls skip TCP/TLS setup. Connection
+            # failures are retried at the transport level.
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(
+                    max_keepalive_connections=20,
+                    max_connections=40,
+                    keepalive_expiry=60.0
+                ),
+                retries=2
+            )
+            # Auth headers never change, so they live on the client and
+            # requests don't build or merge a per-call header dict
+            self._client = httpx.AsyncClient(
+                timeout=60.0,
+                headers=self._get_auth_headers(),
+                transport=transport
+            )
         return self._client
     
     def _get_auth_headers(self) -> dict:
-        """Generate authentication headers"""
-        import base64
-
-        # QC uses Basic auth with userId:token
-        credentials = f"{self.user_id}:{self.api_token}"
-        encoded = base64.b64encode(credentials.encode()).decode()
-
-        return {
-            "Authorization": f"Basic {encoded}",
-            "Content-Type": "application/json"
-        }
+        """Authentication headers, built once per client"""
+        if self._auth_headers is None:
+            # QC uses Basic auth with userId:token
+            credentials = f"{self.user_id}:{self.api_token}"
+            encoded = base64.b64encode(credentials.encode()).decode()
+            
+            self._auth_headers = {
+                "Authorization": f"Basic {encoded}",
+                "Content-Type": "application/json"
+            }
+        return self._auth_headers
     
     async def _request(
         self,
@@ -59,15 +82,17 @@ class QuantConnectClient:
         data: Optional[dict] = None
     ) -> dict:
         """Make authenticated API request"""
-        print(f"Making QC API request: {method} {endpoint}", flush=True)
-        print(f"User ID: {self.user_id}", flush=True)
+        logger.debug("QC API request: %s %s", method, endpoint)
         url = f"{self.BASE_URL}/{endpoint}"
-        headers = self._get_auth_headers()
         
         if method == "GET":
-            response = await self.client.get(url, headers=headers, params=data)
+            response = await self.client.get(
+                url, params=data
+            )
         else:
-            response = await self.client.post(url, headers=headers, json=data)
+            response = await self.client.post(
+                url, json=data
+            )
         
         response.raise_for_status()
         return response.json()
@@ -128,8 +153,10 @@ class QuantConnectClient:
         
         compile_id = result.get("compileId")
         
-        # Poll for compilation completion
-        for _ in range(30):  # Max 30 seconds
+        # Poll for compilation completion, backing off from 0.25s to 2s
+        deadline = time.monotonic() + 30  # Max 30 seconds
+        delay = 0.25
+        while time.monotonic() < deadline:
             status = await self._request("GET", "compile/read", {
                 "projectId": project_id,
                 "compileId": compile_id
@@ -148,7 +175,8 @@ class QuantConnectClient:
                     "errors": status.get("errors", [])
                 }
             
-            await asyncio.sleep(1)
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 2.0)
         
         return {"success": False, "errors": ["Compilation timeout"]}
     
@@ -182,10 +210,11 @@ class QuantConnectClient:
         timeout: int = 300
     ) -> Optional[dict]:
         """
-        Poll until backtest completes
+        Poll until backtest completes, backing off from 1s to 15s
         Returns results or None on timeout
         """
         start = time.time()
+        delay = 1.0
         
         while time.time() - start < timeout:
             result = await self.get_backtest(project_id, backtest_id)
@@ -205,7 +234,8 @@ class QuantConnectClient:
                     "raw": result
                 }
             
-            await asyncio.sleep(5)
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 15.0)
         
         return None
     
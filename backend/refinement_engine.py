@@ -3,12 +3,21 @@ Refinement Engine - Core autonomous loop logic
 Handles backtest execution, Claude analysis, and code updates
 """
 
+import ast
 import asyncio
-import json
+import functools
+import hashlib
+import logging
+import re
+import statistics
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
 from typing import Callable, Optional
 import anthropic
 import httpx
+import orjson
+from pydantic import ValidationError
 
 from models import (
     Strategy,
@@ -20,6 +29,204 @@ from models import (
 from database import Database
 from quantconnect_client import QuantConnectClient
 
+logger = logging.getLogger(__name__)
+
+
+# Shared by the analyze and generate calls; part of the cached prefix
+SYSTEM_PROMPT = (
+    "You are autonomously refining a QuantConnect Lean trading algorithm, "
+    "analyzing its backtest results and improving its code."
+)
+
+# Connection pool for the Claude client. QuantConnect keeps its own: keep-alive
+# is per host, so a shared pool would reuse nothing
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=40)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Prompt caching predates GA in the pinned SDK
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+# Fenced blocks in Claude's responses; the fence language is optional
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+_CODE_FENCE = re.compile(r"```(?:python)?\s*(.*?)\s*```", re.DOTALL)
+_PATCH_FENCE = re.compile(r"```(?:json)?\s*(\[.*?\])\s*```", re.DOTALL)
+
+# Static halves of the analyze and generate instructions, kept as
+# constants so the text after the cached code block is byte-identical
+# from one iteration to the next
+ANALYZE_INSTRUCTIONS = """Analyze the backtest results below and provide:
+1. DIAGNOSIS: What is the single biggest weakness or opportunity for improvement?
+2. HYPOTHESIS: A specific, testable change to address the diagnosis
+3. CONFIDENCE: Your confidence level (low/medium/high) that this change will improve the focus metric
+4. RISK: Any risks or potential negative effects of this change
+
+Respond in JSON format:
+{
+    "diagnosis": "string describing the main issue",
+    "hypothesis": "string describing the proposed change",
+    "suggested_changes": [
+        {
+            "type": "parameter|logic|filter|exit|entry",
+            "description": "what to change",
+            "rationale": "why this should help"
+        }
+    ],
+    "confidence": "low|medium|high",
+    "risk_assessment": "string describing potential downsides"
+}
+"""
+GENERATE_INSTRUCTIONS = """Modify the algorithm above based on the analysis below.
+
+## Instructions
+1. Implement the suggested changes
+2. Keep changes minimal and focused on the hypothesis
+3. Preserve all existing functionality unless explicitly changing it
+4. Add a comment noting the change, tagged with the new version (e.g., "# v7: adjusted X for Y")
+5. Ensure the code remains valid QuantConnect Lean Python
+"""
+
+# Output formats for the generate call
+FULL_FILE_FORMAT = (
+    "\nReturn ONLY the complete updated code, no explanations. "
+    "The code must be syntactically valid and ready to compile.\n"
+)
+PATCH_FORMAT = (
+    "\nReturn ONLY a JSON array of patches to apply to the code, no "
+    'explanations: [{"find": "exact existing text", "replace": "new text"}]. '
+    "Each find must appear exactly once in the current code; include enough "
+    "surrounding text to make it unique.\n"
+)
+
+# Rule-based guesses at the analysis, tried in order; the first whose
+# condition holds seeds the speculative code generation
+#   (condition, diagnosis, hypothesis, change type)
+TEMPLATE_RULES = (
+    (
+        lambda r: r.max_drawdown > 0.20,
+        "Drawdown is above 20%",
+        "Tighten the stop loss to reduce drawdown",
+        "exit",
+    ),
+    (
+        lambda r: r.trade_count < 10,
+        "Too few trades for the results to be meaningful",
+        "Loosen the entry conditions to increase the trade count",
+        "entry",
+    ),
+    (
+        lambda r: r.win_rate < 0.40,
+        "Win rate is below 40%",
+        "Add an entry filter to avoid low quality trades and raise the win rate",
+        "filter",
+    ),
+    (
+        lambda r: True,
+        "Risk-adjusted returns can be improved",
+        "Tune the strategy parameters to improve the sharpe ratio",
+        "parameter",
+    ),
+)
+
+# Fraction of the template's keywords the real hypothesis must share
+# for the speculative code to be used
+SPECULATION_MATCH_THRESHOLD = 0.5
+
+_WORD = re.compile(r"[a-z]{4,}")
+
+# Words nearly every hypothesis uses, which say nothing about the change
+_SPECULATION_STOPWORDS = frozenset({
+    "strategy", "strategies", "algorithm", "improve", "improves",
+    "improving", "improvement", "performance", "sharpe", "ratio", "returns",
+    "return", "risk", "adjusted", "better", "overall", "change", "changes",
+    "should", "could", "would", "this", "that", "these", "with", "from",
+    "into", "more", "less", "than", "their", "which", "while", "when",
+})
+
+# Progress updates allowed to queue up before new ones are dropped.
+# Lifecycle updates (iteration_complete, error, ...) are never dropped
+UPDATE_QUEUE_SIZE = 256
+PROGRESS_EVENTS = frozenset({"code_token", "phase"})
+
+# Streamed code is sent to clients in batches of at least this many
+# characters, or whatever has arrived after this many seconds
+CODE_TOKEN_FLUSH_CHARS = 512
+CODE_TOKEN_FLUSH_SECONDS = 0.25
+
+# Code cache blocks: the API allows four cache breakpoints per request, and
+# a prefix shorter than ~1024 tokens isn't cached on its own
+MAX_CODE_CACHE_BLOCKS = 4
+CACHE_BLOCK_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+# Distinct code versions whose backtest results are kept for reuse
+BACKTEST_CACHE_SIZE = 32
+
+# Iterations of improvement considered when checking for a plateau
+PLATEAU_WINDOW = 5
+
+# Focus metric -> BacktestResult field, and the direction that counts as
+# an improvement (lower drawdown is better)
+_METRIC_FIELDS = {
+    "sharpe": "sharpe_ratio",
+    "drawdown": "max_drawdown",
+    "return": "total_return",
+}
+_SIGN = {"sharpe": 1.0, "drawdown": -1.0, "return": 1.0}
+
+
+def _statement_start(node: ast.stmt) -> int:
+    """0-based first line of a statement, including any decorators"""
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [d.lineno for d in decorators]) - 1
+
+
+@functools.lru_cache(maxsize=8)
+def _split_code_for_cache(
+    code: str,
+    block_tokens: int = CACHE_BLOCK_TOKENS
+) -> tuple[str, ...]:
+    """
+    Split code into at most MAX_CODE_CACHE_BLOCKS evenly sized chunks of
+    at least block_tokens each, breaking only between top-level statements
+    or the methods of a top-level class (Lean algorithms are usually a
+    single QCAlgorithm subclass)
+    The chunks concatenate back to the exact original code
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return (code,)
+    
+    starts = set()
+    for node in tree.body:
+        starts.add(_statement_start(node))
+        if isinstance(node, ast.ClassDef):
+            starts.update(_statement_start(child) for child in node.body[1:])
+    starts.discard(0)
+    
+    lines = code.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    
+    # Aim each break at the next multiple of the target size and snap it
+    # to the nearest statement start that leaves both neighbours big enough
+    min_chars = block_tokens * CHARS_PER_TOKEN
+    target = max(min_chars, len(code) // MAX_CODE_CACHE_BLOCKS)
+    candidates = [offsets[start] for start in starts]
+    breaks = [0]
+    for k in range(1, MAX_CODE_CACHE_BLOCKS):
+        allowed = [
+            offset for offset in candidates
+            if offset - breaks[-1] >= min_chars
+            and len(code) - offset >= min_chars
+        ]
+        if not allowed:
+            break
+        breaks.append(min(allowed, key=lambda offset: abs(offset - k * target)))
+    breaks.append(len(code))
+    return tuple(code[a:b] for a, b in zip(breaks, breaks[1:]))
+
 
 class RefinementEngine:
     """
@@ -47,31 +254,69 @@ class RefinementEngine:
         self.iteration_count = 0
         self.last_update: Optional[datetime] = None
         
-        # Initialize clients
-        self.claude = anthropic.Anthropic()
+        # Initialize clients on persistent, pooled connections that live
+        # as long as the engine; close() releases them. Connection failures
+        # are retried at the transport level
+        self._http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=HTTP_LIMITS,
+                retries=2
+            ),
+            timeout=HTTP_TIMEOUT
+        )
+        self.claude = anthropic.AsyncAnthropic(http_client=self._http)
         self.qc = QuantConnectClient()
         
-        # Track recent iterations for context
-        self.iteration_history: list[Iteration] = []
-        self.plateau_count = 0
+        # Track recent iterations for context (oldest first)
+        self.iteration_history: deque[Iteration] = deque(maxlen=10)
+        # Pre-formatted prompt lines for the last 5 iterations, appended
+        # once per iteration so the history text is never rebuilt
+        self._history_lines: deque[str] = deque(maxlen=5)
+        # Per-metric series of recent results (oldest first), capped at the
+        # plateau window since improvement only reads the latest value
+        self._metric_series = self._empty_metric_series()
+        # Improvements over the last PLATEAU_WINDOW iterations of this run
+        self._improvements: deque[float] = deque(maxlen=PLATEAU_WINDOW)
+        # Updates waiting to be broadcast; run() starts the pump that drains
+        # them so the loop never waits on slow clients. Only progress
+        # updates are bounded, by _queued_progress
+        self._ws_q: asyncio.Queue[tuple[str, dict]] = asyncio.Queue()
+        self._queued_progress = 0
+        self._ws_worker: Optional[asyncio.Task] = None
+        # Backtest results by code hash, least recently used first
+        self._backtest_cache: OrderedDict[bytes, BacktestResult] = OrderedDict()
     
     async def run(self, strategy: Strategy):
         """Main refinement loop"""
         self.is_running = True
-        print(f"Starting refinement loop for strategy: {strategy.name}", flush=True)
-        print(f"Strategy QC Project ID: {strategy.qc_project_id}", flush=True)
-        print(f"Config: {self.config}", flush=True)
+        logger.info(
+            "Starting refinement loop for strategy %s (QC project %s)",
+            strategy.name,
+            strategy.qc_project_id
+        )
+        logger.info("Config: %s", self.config)
         self.current_strategy_id = strategy.id
         self.iteration_count = 0
-        self.plateau_count = 0
+        self._improvements.clear()
         
-        # Load existing iteration history
-        self.iteration_history = await self.db.get_iterations(
+        # Load existing iteration history (the DB returns newest first)
+        history = await self.db.get_iterations(
             strategy.id, 
-            limit=10
+            limit=10,
+            include_code=False
+        )
+        self.iteration_history = deque(reversed(history), maxlen=10)
+        self._history_lines = deque(
+            (self._format_history_line(i) for i in self.iteration_history),
+            maxlen=5
         )
+        self._metric_series = self._empty_metric_series()
+        for past in self.iteration_history:
+            self._record_metrics(past.backtest_result)
         
-        await self.on_update("loop_started", {
+        self._ws_worker = asyncio.create_task(self._ws_pump())
+        self._emit("loop_started", {
             "strategy_id": strategy.id,
             "strategy_name": strategy.name
         })
@@ -90,7 +335,7 @@ class RefinementEngine:
 
                     # Check iteration limit
                     if self.config.max_iterations and self.iteration_count >= self.config.max_iterations:
-                        await self.on_update("max_iterations_reached", {
+                        self._emit("max_iterations_reached", {
                             "count": self.iteration_count
                         })
                         break
@@ -101,87 +346,172 @@ class RefinementEngine:
                     if iteration:
                         self.iteration_count += 1
                         self.iteration_history.append(iteration)
-
-                        # Keep only recent history
-                        if len(self.iteration_history) > 10:
-                            self.iteration_history.pop(0)
+                        self._history_lines.append(
+                            self._format_history_line(iteration)
+                        )
+                        self._record_metrics(iteration.backtest_result)
 
                         # Check for plateau
-                        if self._check_plateau(iteration):
-                            self.plateau_count += 1
-                            if self.config.auto_stop_on_plateau and self.plateau_count >= 3:
-                                await self.on_update("plateau_detected", {
-                                    "message": "Performance has plateaued, stopping loop"
-                                })
-                                break
-                        else:
-                            self.plateau_count = 0
+                        self._improvements.append(iteration.improvement)
+                        if self.config.auto_stop_on_plateau and self._check_plateau():
+                            self._emit("plateau_detected", {
+                                "message": "Performance has plateaued, stopping loop"
+                            })
+                            break
 
                     # Cooldown between iterations
-                    await self.on_update("cooldown", {
+                    self._emit("cooldown", {
                         "seconds": self.config.backtest_cooldown
                     })
                     await asyncio.sleep(self.config.backtest_cooldown)
                 except Exception as e:
-                    print(f"Loop error: {e}", flush=True)
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception("Loop error")
                     raise
 
         except Exception as e:
-            await self.on_update("error", {"message": str(e)})
+            self._emit("error", {"message": str(e)})
         finally:
             self.is_running = False
-            await self.on_update("loop_stopped", {
+            # Flushed with everything queued before it
+            self._emit("loop_stopped", {
                 "total_iterations": self.iteration_count
             })
+            await self._ws_q.join()
+            self._ws_worker.cancel()
+            await self.close()
+    
+    def _emit(self, event: str, data: dict):
+        """
+        Queue an update for broadcast without waiting on the clients
+        Progress updates are dropped once UPDATE_QUEUE_SIZE of them are
+        waiting; lifecycle updates are always queued
+        """
+        if event in PROGRESS_EVENTS:
+            if self._queued_progress >= UPDATE_QUEUE_SIZE:
+                logger.debug("Update queue full, dropping %s event", event)
+                return
+            self._queued_progress += 1
+        self._ws_q.put_nowait((event, data))
+    
+    async def _ws_pump(self):
+        """Forward queued updates to on_update one at a time, in order"""
+        while True:
+            event, data = await self._ws_q.get()
+            if event in PROGRESS_EVENTS:
+                self._queued_progress -= 1
+            try:
+                await self.on_update(event, data)
+            except Exception:
+                logger.exception("Broadcasting %s update failed", event)
+            finally:
+                self._ws_q.task_done()
+    
+    async def close(self):
+        """Release the engine's HTTP connections"""
+        await self.qc.close()
+        await self._http.aclose()
+    
+    async def __aenter__(self) -> "RefinementEngine":
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
     
     async def _run_iteration(self, strategy: Strategy) -> Optional[Iteration]:
         """Execute a single refinement iteration"""
-        iteration_id = f"iter_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # Unique even when iterations finish within the same second
+        iteration_id = f"iter_{self.iteration_count + 1:05d}_{time.time_ns():x}"
         
-        await self.on_update("iteration_started", {
+        self._emit("iteration_started", {
             "iteration_id": iteration_id,
             "iteration_number": self.iteration_count + 1
         })
         
-        # Step 1: Run backtest
-        await self.on_update("phase", {"phase": "backtesting"})
-        backtest_result = await self._run_backtest(strategy)
+        # Step 1: Run backtest. The history context only depends on earlier
+        # iterations, so it's built up front for the analysis step
+        code_hash = self._code_hash(strategy.code)
+        history_context = self._build_history_context()
+        self._emit("phase", {"phase": "backtesting"})
+        backtest_result = await self._cached_backtest(strategy, code_hash)
         
         if not backtest_result:
-            await self.on_update("backtest_failed", {})
+            self._emit("backtest_failed", {})
             return None
         
-        await self.on_update("backtest_complete", {
+        self._emit("backtest_complete", {
             "sharpe": backtest_result.sharpe_ratio,
             "max_drawdown": backtest_result.max_drawdown,
             "total_return": backtest_result.total_return
         })
         
-        # Step 2: Analyze with Claude
-        await self.on_update("phase", {"phase": "analyzing"})
-        analysis = await self._analyze_results(strategy, backtest_result)
+        # Step 2: Analyze with Claude, drafting code for a template
+        # analysis alongside it when speculation is enabled
+        self._emit("phase", {"phase": "analyzing"})
+        template = None
+        speculative_task = None
+        if self.config.speculative_codegen:
+            template = self._template_analysis(backtest_result)
+            speculative_task = asyncio.create_task(self._generate_code_changes(
+                strategy,
+                template,
+                backtest_result,
+                stream_updates=False
+            ))
         
-        await self.on_update("analysis_complete", {
+        try:
+            analysis = await self._analyze_results(
+                strategy,
+                backtest_result,
+                history_context
+            )
+        except BaseException:
+            if speculative_task:
+                await self._cancel_draft(speculative_task)
+            raise
+        
+        self._emit("analysis_complete", {
             "diagnosis": analysis.diagnosis,
             "suggested_changes": len(analysis.suggested_changes)
         })
         
         # Step 3: Generate code changes
-        await self.on_update("phase", {"phase": "generating_code"})
-        new_code = await self._generate_code_changes(
-            strategy, 
-            analysis,
-            backtest_result
-        )
+        self._emit("phase", {"phase": "generating_code"})
+        new_code = None
+        if speculative_task:
+            if self._hypotheses_match(template, analysis):
+                try:
+                    new_code = await speculative_task
+                except Exception:
+                    logger.exception("Speculative generation failed")
+                else:
+                    # Keep the real analysis; the event records that the
+                    # saved code came from the template draft
+                    self._emit("speculation_used", {
+                        "hypothesis": template.hypothesis
+                    })
+            else:
+                await self._cancel_draft(speculative_task)
+        
+        if new_code is None and self.is_running:
+            new_code = await self._generate_code_changes(
+                strategy, 
+                analysis,
+                backtest_result
+            )
         
-        # Step 4: Save iteration
+        if new_code is None:
+            # Stopped mid-generation; discard the partial iteration
+            return None
+        
+        # Step 4: Save iteration. Code that comes back unchanged isn't a
+        # new version
+        unchanged = self._code_hash(new_code) == code_hash
+        now = datetime.now()
         iteration = Iteration(
             id=iteration_id,
             strategy_id=strategy.id,
             version=strategy.current_version,
-            timestamp=datetime.now(),
+            timestamp=now,
             backtest_result=backtest_result,
             analysis=analysis,
             code_before=strategy.code,
@@ -189,16 +519,21 @@ class RefinementEngine:
             improvement=self._calculate_improvement(backtest_result)
         )
         
-        await self.db.save_iteration(iteration)
-        
-        # Step 5: Update strategy code
-        strategy.code = new_code
-        strategy.current_version += 1
-        await self.db.save_strategy(strategy)
+        # Step 5: Update strategy code, saving it with the iteration
+        if unchanged:
+            logger.info(
+                "Generated code is unchanged, keeping v%d",
+                strategy.current_version
+            )
+            await self.db.save_iteration(iteration)
+        else:
+            strategy.code = new_code
+            strategy.current_version += 1
+            await self.db.save_iteration_and_bump_strategy(iteration, strategy)
         
-        self.last_update = datetime.now()
+        self.last_update = now
         
-        await self.on_update("iteration_complete", {
+        self._emit("iteration_complete", {
             "iteration_id": iteration_id,
             "improvement": iteration.improvement,
             "new_version": strategy.current_version
@@ -206,33 +541,65 @@ class RefinementEngine:
         
         return iteration
     
+    async def _cached_backtest(
+        self,
+        strategy: Strategy,
+        code_hash: bytes
+    ) -> Optional[BacktestResult]:
+        """Backtest the strategy unless this exact code already has a result"""
+        result = self._backtest_cache.get(code_hash)
+        if result is not None:
+            self._backtest_cache.move_to_end(code_hash)
+            logger.info("Reusing backtest %s for unchanged code", result.backtest_id)
+            return result
+        
+        result = await self._run_backtest(strategy)
+        if result is not None:
+            self._backtest_cache[code_hash] = result
+            if len(self._backtest_cache) > BACKTEST_CACHE_SIZE:
+                self._backtest_cache.popitem(last=False)
+        return result
+    
+    @staticmethod
+    def _code_hash(code: str) -> bytes:
+        """Digest of the code, ignoring trailing whitespace"""
+        normalized = "\n".join(line.rstrip() for line in code.strip().splitlines())
+        return hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+    
     async def _run_backtest(self, strategy: Strategy) -> Optional[BacktestResult]:
         """Submit strategy to QuantConnect and get results"""
-        print(f"_run_backtest called for strategy: {strategy.name}, project: {strategy.qc_project_id}", flush=True)
+        logger.info(
+            "Backtesting strategy %s v%d (QC project %s)",
+            strategy.name,
+            strategy.current_version,
+            strategy.qc_project_id
+        )
 
         try:
-            print("Attempting to compile project...", flush=True)
             compile_result = await self.qc.compile_project(
                 strategy.qc_project_id,
                 strategy.code
             )
-            print(f"Compile result: {compile_result}", flush=True)
+            logger.debug("Compile result: %s", compile_result)
 
             if not compile_result.get("success"):
-                print(f"Compile failed: {compile_result}", flush=True)
+                logger.warning("Compile failed: %s", compile_result)
                 return None
 
-            print("Creating backtest...", flush=True)
             backtest_id = await self.qc.create_backtest(
                 strategy.qc_project_id,
                 compile_result["compileId"],
                 f"Refinement v{strategy.current_version}"
             )
-            print(f"Backtest ID: {backtest_id}", flush=True)
+            logger.info("Created backtest %s", backtest_id)
+
+            self._emit("backtest_submitted", {
+                "backtest_id": backtest_id,
+                "version": strategy.current_version
+            })
 
-            print("Waiting for backtest to complete...", flush=True)
             result = await self.qc.wait_for_backtest(backtest_id)
-            print(f"Backtest result: {result}", flush=True)
+            logger.debug("Backtest result: %s", result)
 
             if not result:
                 return None
@@ -248,28 +615,22 @@ class RefinementEngine:
                 raw_data=result
             )
 
-        except Exception as e:
-            print(f"Backtest error: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Backtest error")
             return None
     
     async def _analyze_results(
         self, 
         strategy: Strategy, 
-        result: BacktestResult
+        result: BacktestResult,
+        history_context: str
     ) -> AnalysisResult:
         """Use Claude to analyze backtest results"""
         
-        # Build context from iteration history
-        history_context = self._build_history_context()
-        
-        prompt = f"""You are analyzing trading strategy backtest results for autonomous refinement.
-
-## Strategy
-Name: {strategy.name}
-Description: {strategy.description or "N/A"}
-
+        # The numbers that change every call come after the static text
+        instructions = "".join([
+            ANALYZE_INSTRUCTIONS,
+            f"""
 ## Current Backtest Results
 Sharpe Ratio: {result.sharpe_ratio:.3f}
 Max Drawdown: {result.max_drawdown:.2%}
@@ -284,50 +645,29 @@ Avg Trade Duration: {result.avg_trade_duration}
 ## Focus Metric
 Primary optimization target: {self.config.focus_metric}
 Improvement threshold: {self.config.improvement_threshold:.1%}
-
-## Current Code
-```python
-{strategy.code}
-```
-
-Analyze these results and provide:
-1. DIAGNOSIS: What is the single biggest weakness or opportunity for improvement?
-2. HYPOTHESIS: A specific, testable change to address the diagnosis
-3. CONFIDENCE: Your confidence level (low/medium/high) that this change will improve the focus metric
-4. RISK: Any risks or potential negative effects of this change
-
-Respond in JSON format:
-{{
-    "diagnosis": "string describing the main issue",
-    "hypothesis": "string describing the proposed change",
-    "suggested_changes": [
-        {{
-            "type": "parameter|logic|filter|exit|entry",
-            "description": "what to change",
-            "rationale": "why this should help"
-        }}
-    ],
-    "confidence": "low|medium|high",
-    "risk_assessment": "string describing potential downsides"
-}}
 """
+        ])
         
-        response = self.claude.messages.create(
+        response = await self.claude.messages.create(
             model="claude-sonnet-4-20250514",
             max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}]
+            system=SYSTEM_PROMPT,
+            messages=[{
+                "role": "user",
+                "content": [
+                    *self._code_blocks(strategy),
+                    {"type": "text", "text": instructions}
+                ]
+            }],
+            extra_headers=PROMPT_CACHING_HEADERS
         )
         
         # Parse response
         try:
             content = response.content[0].text
             # Extract JSON from response
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-            
-            data = json.loads(content)
+            match = _JSON_FENCE.search(content)
+            data = orjson.loads(match.group(1) if match else content.strip())
             
             return AnalysisResult(
                 diagnosis=data["diagnosis"],
@@ -336,7 +676,7 @@ Respond in JSON format:
                 confidence=data["confidence"],
                 risk_assessment=data["risk_assessment"]
             )
-        except Exception as e:
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValidationError):
             # Fallback analysis
             return AnalysisResult(
                 diagnosis="Unable to parse detailed analysis",
@@ -350,96 +690,266 @@ Respond in JSON format:
         self,
         strategy: Strategy,
         analysis: AnalysisResult,
-        result: BacktestResult
-    ) -> str:
-        """Generate updated strategy code based on analysis"""
-        
-        prompt = f"""You are modifying a QuantConnect Lean trading algorithm based on analysis.
-
-## Current Code
-```python
-{strategy.code}
-```
-
+        result: BacktestResult,
+        stream_updates: bool = True
+    ) -> Optional[str]:
+        """
+        Generate updated strategy code based on analysis
+        Returns None if the loop is stopped before generation finishes
+        """
+        
+        suggested_changes = orjson.dumps(
+            analysis.suggested_changes,
+            option=orjson.OPT_INDENT_2
+        ).decode()
+        instructions = "".join([
+            GENERATE_INSTRUCTIONS,
+            f"""
 ## Analysis
 Diagnosis: {analysis.diagnosis}
 Hypothesis: {analysis.hypothesis}
-Suggested Changes: {json.dumps(analysis.suggested_changes, indent=2)}
+Suggested Changes: {suggested_changes}
 
 ## Current Performance
 Sharpe: {result.sharpe_ratio:.3f}
 Max DD: {result.max_drawdown:.2%}
 Win Rate: {result.win_rate:.2%}
 
-## Instructions
-1. Implement the suggested changes
-2. Keep changes minimal and focused on the hypothesis
-3. Preserve all existing functionality unless explicitly changing it
-4. Add a comment noting the change (e.g., "# v{strategy.current_version + 1}: adjusted X for Y")
-5. Ensure the code remains valid QuantConnect Lean Python
-
-Return ONLY the complete updated code, no explanations. The code must be syntactically valid and ready to compile.
+## New Version
+v{strategy.current_version + 1}
 """
-        
-        response = self.claude.messages.create(
-            model="claude-sonnet-4-20250514",
+        ])
+        
+        # Parameter tweaks touch a few lines, so ask for patches instead of
+        # the whole file; fall back to the full file if they don't apply
+        changes = analysis.suggested_changes
+        if changes and all(c.get("type") == "parameter" for c in changes):
+            content = await self._stream_response(
+                strategy,
+                instructions + PATCH_FORMAT,
+                max_tokens=1500,
+                stream_updates=False
+            )
+            if content is None:
+                return None
+            new_code = self._apply_patches(strategy.code, content)
+            if new_code is not None:
+                return new_code
+            logger.info("Patches did not apply, regenerating full file")
+        
+        content = await self._stream_response(
+            strategy,
+            instructions + FULL_FILE_FORMAT,
             max_tokens=8000,
-            messages=[{"role": "user", "content": prompt}]
+            stream_updates=stream_updates
         )
-        
-        content = response.content[0].text
+        if content is None:
+            return None
         
         # Extract code from response
-        if "```python" in content:
-            content = content.split("```python")[1].split("```")[0]
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0]
+        match = _CODE_FENCE.search(content)
+        return match.group(1) if match else content.strip()
+    
+    async def _stream_response(
+        self,
+        strategy: Strategy,
+        instructions: str,
+        max_tokens: int,
+        stream_updates: bool
+    ) -> Optional[str]:
+        """
+        Stream a code-generation response so the UI sees progress and a
+        stop request doesn't wait out the full generation
+        Returns None if the loop is stopped first
+        """
+        chunks: list[str] = []
+        pending: list[str] = []
+        pending_chars = 0
+        last_flush = time.monotonic()
+        async with self.claude.messages.stream(
+            model="claude-sonnet-4-20250514",
+            max_tokens=max_tokens,
+            system=SYSTEM_PROMPT,
+            messages=[{
+                "role": "user",
+                "content": [
+                    *self._code_blocks(strategy),
+                    {"type": "text", "text": instructions}
+                ]
+            }],
+            extra_headers=PROMPT_CACHING_HEADERS
+        ) as stream:
+            async for text in stream.text_stream:
+                chunks.append(text)
+                if stream_updates:
+                    pending.append(text)
+                    pending_chars += len(text)
+                    now = time.monotonic()
+                    if (
+                        pending_chars >= CODE_TOKEN_FLUSH_CHARS
+                        or now - last_flush >= CODE_TOKEN_FLUSH_SECONDS
+                    ):
+                        self._emit("code_token", {"chunk": "".join(pending)})
+                        pending.clear()
+                        pending_chars = 0
+                        last_flush = now
+                if not self.is_running:
+                    return None
+        
+        if pending:
+            self._emit("code_token", {"chunk": "".join(pending)})
+        return "".join(chunks)
+    
+    @staticmethod
+    def _apply_patches(code: str, content: str) -> Optional[str]:
+        """
+        Apply a response's find/replace patches to the code
+        Returns None unless every patch's find text occurs exactly once
+        """
+        match = _PATCH_FENCE.search(content)
+        try:
+            patches = orjson.loads(match.group(1) if match else content.strip())
+        except orjson.JSONDecodeError:
+            return None
+        if not isinstance(patches, list) or not patches:
+            return None
         
-        return content.strip()
+        for patch in patches:
+            if not isinstance(patch, dict):
+                return None
+            find, replace = patch.get("find"), patch.get("replace")
+            if not isinstance(find, str) or not isinstance(replace, str):
+                return None
+            if not find or code.count(find) != 1:
+                return None
+            code = code.replace(find, replace, 1)
+        return code
+    
+    def _code_blocks(self, strategy: Strategy) -> list[dict]:
+        """
+        The strategy source as cacheable content blocks
+        Identical bytes in the analyze and generate calls, so the second
+        call of an iteration reuses the first call's cached prefill. The
+        code is split at top-level definitions so an edit near the end of
+        the file still hits the cache for the blocks before it
+        """
+        chunks = list(_split_code_for_cache(strategy.code))
+        chunks[0] = f"""## Strategy
+Name: {strategy.name}
+Description: {strategy.description or "N/A"}
+
+## Current Code
+```python
+{chunks[0]}"""
+        chunks[-1] += "\n```\n"
+        return [
+            {
+                "type": "text",
+                "text": chunk,
+                "cache_control": {"type": "ephemeral"}
+            }
+            for chunk in chunks
+        ]
     
     def _build_history_context(self) -> str:
         """Build context string from recent iterations"""
-        if not self.iteration_history:
-            return "No previous iterations"
-        
-        lines = []
-        for i, iteration in enumerate(self.iteration_history[-5:], 1):
-            result = iteration.backtest_result
-            lines.append(
-                f"v{iteration.version}: Sharpe {result.sharpe_ratio:.3f}, "
-                f"DD {result.max_drawdown:.2%}, WR {result.win_rate:.2%} | "
-                f"Change: {iteration.analysis.hypothesis[:50]}..."
-            )
-        
-        return "\n".join(lines)
+        return "\n".join(self._history_lines) or "No previous iterations"
+    
+    @staticmethod
+    def _format_history_line(iteration: Iteration) -> str:
+        """One line of history context for an iteration"""
+        result = iteration.backtest_result
+        return (
+            f"v{iteration.version}: Sharpe {result.sharpe_ratio:.3f}, "
+            f"DD {result.max_drawdown:.2%}, WR {result.win_rate:.2%} | "
+            f"Change: {iteration.analysis.hypothesis[:50]}..."
+        )
+    
+    @staticmethod
+    async def _cancel_draft(task: asyncio.Task):
+        """
+        Cancel a speculative generation and wait for it to finish,
+        without swallowing a cancellation of the current task
+        """
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+        except Exception:
+            logger.debug("Discarded speculative generation failed", exc_info=True)
+    
+    @staticmethod
+    def _template_analysis(result: BacktestResult) -> AnalysisResult:
+        """Cheap rule-based analysis used to draft code speculatively"""
+        for condition, diagnosis, hypothesis, change_type in TEMPLATE_RULES:
+            if condition(result):
+                return AnalysisResult(
+                    diagnosis=diagnosis,
+                    hypothesis=hypothesis,
+                    suggested_changes=[{
+                        "type": change_type,
+                        "description": hypothesis,
+                        "rationale": diagnosis
+                    }],
+                    confidence="low",
+                    risk_assessment="Template analysis"
+                )
+    
+    @staticmethod
+    def _hypotheses_match(template: AnalysisResult, analysis: AnalysisResult) -> bool:
+        """
+        Whether the real analysis proposes the template's change: the
+        template's change type must be among the suggested ones, and the
+        hypotheses must share enough non-generic keywords
+        """
+        change_type = template.suggested_changes[0]["type"]
+        if change_type not in {c.get("type") for c in analysis.suggested_changes}:
+            return False
+        
+        expected = set(_WORD.findall(template.hypothesis.lower()))
+        expected -= _SPECULATION_STOPWORDS
+        proposed = set(_WORD.findall(analysis.hypothesis.lower()))
+        return len(expected & proposed) >= SPECULATION_MATCH_THRESHOLD * len(expected)
+    
+    @staticmethod
+    def _empty_metric_series() -> dict[str, deque[float]]:
+        return {
+            metric: deque(maxlen=PLATEAU_WINDOW)
+            for metric in _METRIC_FIELDS
+        }
+    
+    def _record_metrics(self, result: BacktestResult):
+        """Append a backtest's focus metrics to their series"""
+        for metric, field in _METRIC_FIELDS.items():
+            self._metric_series[metric].append(getattr(result, field))
     
     def _calculate_improvement(self, result: BacktestResult) -> float:
         """Calculate improvement over previous iteration"""
-        if not self.iteration_history:
-            return 0.0
-        
-        prev = self.iteration_history[-1].backtest_result
         metric = self.config.focus_metric
+        series = self._metric_series.get(metric)
+        if not series:
+            return 0.0
         
-        if metric == "sharpe":
-            if prev.sharpe_ratio == 0:
-                return 0.0
-            return (result.sharpe_ratio - prev.sharpe_ratio) / abs(prev.sharpe_ratio)
-        elif metric == "drawdown":
-            if prev.max_drawdown == 0:
-                return 0.0
-            # Lower drawdown is better, so invert
-            return (prev.max_drawdown - result.max_drawdown) / abs(prev.max_drawdown)
-        elif metric == "return":
-            if prev.total_return == 0:
-                return 0.0
-            return (result.total_return - prev.total_return) / abs(prev.total_return)
-        
-        return 0.0
+        prev = series[-1]
+        if prev == 0:
+            return 0.0
+        current = getattr(result, _METRIC_FIELDS[metric])
+        return _SIGN[metric] * (current - prev) / abs(prev)
     
-    def _check_plateau(self, iteration: Iteration) -> bool:
-        """Check if improvement has plateaued"""
-        return abs(iteration.improvement) < self.config.improvement_threshold
+    def _check_plateau(self) -> bool:
+        """
+        Check if improvement has plateaued: over a full window, the
+        improvements neither vary nor average more than the threshold
+        """
+        if len(self._improvements) < PLATEAU_WINDOW:
+            return False
+        threshold = self.config.improvement_threshold
+        return (
+            statistics.pstdev(self._improvements) < threshold
+            and abs(statistics.fmean(self._improvements)) < threshold
+        )
     
     async def stop(self):
         """Stop the refinement loop"""
@@ -5,4 +5,15 @@ print("=== TRADING REFINERY BACKEND STARTING ===", flush=True)
 print(f"PORT: {os.environ.get('PORT', 'not set')}", flush=True)
 
 port = int(os.environ.get("PORT", 8000))
-uvicorn.run("main:app", host="0.0.0.0", port=port)
+# uvloop/httptools come with uvicorn[standard]. One worker only: the
+# refinement engine, websocket clients and SQLite writer live in-process
+uvicorn.run(
+    "main:app",
+    host="0.0.0.0",
+    port=port,
+    loop="uvloop",
+    http="httptools",
+    ws="websockets",
+    workers=1,
+    access_log=False
+)
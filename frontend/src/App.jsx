@@ -30,6 +30,8 @@ const api = {
 };
 
 // ============ WebSocket Hook ============
+const decoder = new TextDecoder();
+
 function useWebSocket(onMessage) {
   const wsRef = useRef(null);
   const reconnectRef = useRef(null);
@@ -37,11 +39,14 @@ function useWebSocket(onMessage) {
   const connect = useCallback(() => {
     const wsUrl = API_BASE.replace('http', 'ws') + '/ws';
     wsRef.current = new WebSocket(wsUrl);
+    // Broadcasts arrive as binary frames; "pong" is still text
+    wsRef.current.binaryType = 'arraybuffer';
 
     wsRef.current.onopen = () => console.log('WS connected');
     wsRef.current.onmessage = (e) => {
       try {
-        const msg = JSON.parse(e.data);
+        const text = typeof e.data === 'string' ? e.data : decoder.decode(e.data);
+        const msg = JSON.parse(text);
         onMessage(msg);
       } catch {}
     };
@@ -315,6 +320,15 @@ function ConfigPanel({ config, onUpdate }) {
           />
           Auto-stop on plateau
         </label>
+
+        <label className="checkbox-label">
+          <input
+            type="checkbox"
+            checked={localConfig.speculative_codegen ?? false}
+            onChange={(e) => handleChange('speculative_codegen', e.target.checked)}
+          />
+          Draft code during analysis
+        </label>
       </div>
     </div>
   );
@@ -347,6 +361,8 @@ export default function App() {
   const [loopStatus, setLoopStatus] = useState({ status: 'stopped' });
   const [config, setConfig] = useState({});
   const [logs, setLogs] = useState([]);
+  const [liveCode, setLiveCode] = useState('');
+  const selectedIdRef = useRef(null);
   const [loading, setLoading] = useState(true);
 
   // Load initial data
@@ -376,15 +392,25 @@ export default function App() {
     api.get(`/iterations/${selectedStrategy.id}`).then((res) => {
       setIterations(res.iterations || []);
     });
-  }, [selectedStrategy]);
+  }, [selectedStrategy?.id]);
 
   // WebSocket handler
   const handleWsMessage = useCallback((msg) => {
     const { event, data } = msg;
+    // Streamed code goes to the live pane, not the activity log
+    if (event === 'code_token') {
+      setLiveCode((code) => code + data.chunk);
+      return;
+    }
+
     const timestamp = new Date().toLocaleTimeString();
     
     setLogs((prev) => [{ event, data, timestamp }, ...prev].slice(0, 100));
 
+    if (event === 'iteration_started') {
+      setLiveCode('');
+    }
+
     if (event === 'iteration_complete') {
       // Refresh iterations
       if (selectedStrategy) {
@@ -405,9 +431,25 @@ export default function App() {
   useWebSocket(handleWsMessage);
 
   // Actions
+  const handleSelectStrategy = async (summary) => {
+    // The list omits code; fetch the full strategy for the code viewer
+    selectedIdRef.current = summary.id;
+    setSelectedStrategy(summary);
+    try {
+      const res = await api.get(`/strategies/${summary.id}?iterations=false`);
+      // Ignore the response if another strategy was selected meanwhile
+      if (selectedIdRef.current === summary.id) {
+        setSelectedStrategy(res.strategy);
+      }
+    } catch (e) {
+      console.error('Strategy load error:', e);
+    }
+  };
+
   const handleNewStrategy = async (name, code, qcProjectId) => {
     const res = await api.post('/strategies', { name, code, qc_project_id: qcProjectId });
     setStrategies((s) => [res.strategy, ...s]);
+    selectedIdRef.current = res.strategy.id;
     setSelectedStrategy(res.strategy);
   };
 
@@ -496,7 +538,7 @@ export default function App() {
           <StrategySelector
             strategies={strategies}
             selected={selectedStrategy}
-            onSelect={setSelectedStrategy}
+            onSelect={handleSelectStrategy}
             onNew={handleNewStrategy}
           />
           <ConfigPanel config={config} onUpdate={handleUpdateConfig} />
@@ -564,7 +606,13 @@ export default function App() {
                 </section>
               )}
 
-              <CodeViewer code={selectedStrategy.code} />
+              {liveCode && loopStatus.current_strategy === selectedStrategy.id && (
+                <CodeViewer code={liveCode} title="Generating Code (live)" />
+              )}
+
+              {selectedStrategy.code != null && (
+                <CodeViewer code={selectedStrategy.code} />
+              )}
             </>
           ) : (
             <div className="empty-state">